@@ -7,12 +7,34 @@ If you run into difficulties, reach out to the person who provided you with this
 import argparse
 import csv
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
 
 # Third-party libraries
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from selenium import webdriver
-from bs4 import BeautifulSoup
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from lxml import html
+
+
+LINE_BREAKS = str.maketrans('', '', '\n\r')
+COMMAS = str.maketrans('', '', ',')
+
+# longer activity types come first so "edited questions" wins over "questions"
+ACTIVITY_TYPES = ('edited questions', 'updated answers', 'accepted answers', 'questions',
+                  'answers', 'comments')
+# hyphens count as word characters so tags like "questions-and-answers" are left alone
+ACTIVITY_TYPE_PATTERN = re.compile(
+    r'(?<![\w-])(' + '|'.join(map(re.escape, ACTIVITY_TYPES)) + r')(?![\w-])')
+# splits a description into everything between "Any" and the first " to " (tags and
+# activity types), and the channel after it
+DESCRIPTION_PATTERN = re.compile(r'^(?:All post activity|Any (?P<body>.+?)) to (?P<channel>.+)$')
 
 
 def main():
@@ -20,10 +42,10 @@ def main():
     args = get_args()
     validate_args(args)
 
-    s = create_session(args.url)
+    s = create_session(args.url, args.headless)
     validate_admin(s, args.url)
 
-    webhooks = get_webhooks(s, args.url)
+    webhooks = get_webhooks(s, args.url, args.pagesize)
     export_webhooks_to_csv(webhooks)
 
 
@@ -38,6 +60,15 @@ def get_args():
     parser.add_argument('--url', 
                         type=str,
                         help='[REQUIRED] Base URL for your Stack Overflow for Teams instance')
+    parser.add_argument('--pagesize',
+                        type=int,
+                        default=250,
+                        help='Number of webhooks to request per page. Larger pages mean fewer '
+                        'requests; the server may cap this value. Default: 250')
+    parser.add_argument('--headless',
+                        action='store_true',
+                        help='Run Chrome without a visible window. Only useful when login '
+                        'completes without user interaction (e.g. single sign-on)')
 
     return parser.parse_args()
 
@@ -51,29 +82,44 @@ def validate_args(args):
     if "stackoverflowteams.com" in args.url:
         print("This script only works for Stack Overflow Enterprise. Sorry.")
         raise SystemExit
+    if args.pagesize < 1:
+        print("Invalid argument: --pagesize must be a positive number")
+        raise SystemExit
 
 
-def create_session(base_url):
+def create_session(base_url, headless=False):
 
     options = webdriver.ChromeOptions()
     options.add_argument("--window-size=500,800")
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
     options.add_experimental_option("excludeSwitches", ['enable-automation'])
     driver = webdriver.Chrome(options=options)
     driver.get(base_url)
 
-    while True:
-        try:
-            driver.find_element("class name", "s-user-card")
-            break
-        except:
-            time.sleep(1)
+    # wait for the user to log in; the user card only renders once a session exists
+    try:
+        WebDriverWait(driver, timeout=600, poll_frequency=0.25).until(
+            EC.presence_of_element_located((By.CLASS_NAME, 's-user-card')))
+    except TimeoutException:
+        print("Timed out waiting for login. Please run the script again.")
+        driver.quit()
+        raise SystemExit
     
-    # pass cookies to requests
-    cookies = driver.get_cookies()
     s = requests.Session()
-    for cookie in cookies:
-        s.cookies.set(cookie['name'], cookie['value'])
-    driver.close()
+    # reuse pooled connections across page requests and retry transient server errors
+    # once retries run out, return the last response so callers still handle its status code
+    adapter = HTTPAdapter(
+        pool_connections=16, pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                          raise_on_status=False))
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+
+    # pass cookies to requests
+    s.cookies = requests.utils.cookiejar_from_dict(
+        {cookie['name']: cookie['value'] for cookie in driver.get_cookies()})
     driver.quit()
     
     return s
@@ -83,7 +129,8 @@ def validate_admin(s, base_url):
 
     admin_url = base_url + '/enterprise/admin-settings'
 
-    response = get_page_response(s, admin_url)
+    # the body is read (not streamed) so the connection goes back to the pool for the page fetches
+    response = s.get(admin_url)
     if response.status_code != 200:
         print("Error: Unable to access admin settings page. Please check your URL and permissions.")
         exit()
@@ -91,46 +138,76 @@ def validate_admin(s, base_url):
 
 def get_page_response(s, url):
 
-    response = s.get(url)
-    if response.status_code == 200:
-        return response
-    else:
+    try:
+        response = s.get(url)
+        response.raise_for_status()
+    except requests.RequestException as e:
         print(f'Error getting page {url}')
-        print(f'Response code: {response.status_code}')
-        return None
+        if e.response is not None:
+            print(f'Response code: {e.response.status_code}')
+        else:
+            print(f'Error: {e}')
+        raise
+
+    return response
 
 
-def get_webhooks(s, base_url):
+def get_webhooks(s, base_url, pagesize=250, max_workers=8):
 
     webhooks_url = base_url + '/enterprise/webhooks'
-    page_count = get_page_count(s, webhooks_url + '?page=1&pagesize=50')
 
-    # get the webhook urls from each page
+    # page 1 carries the pagination links, so its parsed tree is reused for its rows too
+    # if the server caps the page size, the pagination links on page 1 still reflect it
+    first_page = parse_page(get_page_response(s, webhooks_url + f'?page=1&pagesize={pagesize}'))
+    page_count = get_page_count(first_page)
+
+    # the remaining pages are independent, so fetch them concurrently over the shared session
+    # executor.map yields responses in page order, so the output order is unchanged
+    page_urls = [webhooks_url + f'?page={page}&pagesize={pagesize}'
+                 for page in range(2, page_count + 1)]
     webhooks = []
-    for page in range(1, page_count + 1):
-        print(f'Getting webhooks from page {page} of {page_count}')
-        page_url = webhooks_url + f'?page={page}&pagesize=50'
-        response = get_page_response(s, page_url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        webhook_rows = soup.find_all('tr')
-        webhooks += process_webhooks(webhook_rows)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        responses = executor.map(lambda page_url: get_page_response(s, page_url), page_urls)
+        # if a page fails, the map iterator re-raises it and cancels the pages not yet started
+        for page, tree in enumerate(chain([first_page], map(parse_page, responses)), start=1):
+            print(f'Getting webhooks from page {page} of {page_count}')
+            # header rows are excluded by the query itself
+            webhook_rows = tree.xpath('//tr[td and not(th)]')
+            webhooks += process_webhooks(webhook_rows)
 
     return webhooks
 
 
-def get_page_count(s, url):
+def get_page_count(tree):
 
-    response = get_page_response(s, url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    pagination = soup.find_all('a', {'class': 's-pagination--item js-pagination-item'})
+    pagination = tree.xpath('//a[@class="s-pagination--item js-pagination-item"]')
     try:
-        page_count = int(pagination[-2].text)
+        page_count = int(pagination[-2].text_content())
     except IndexError: # only one page
         page_count = 1
 
     return page_count
 
 
+def parse_page(response):
+
+    # hand lxml the raw bytes and a known encoding so it skips encoding detection
+    # requests assumes ISO-8859-1 when the server sends no charset; pages are UTF-8 in that case
+    if 'charset' in response.headers.get('content-type', '').lower():
+        encoding = response.encoding
+    else:
+        encoding = 'utf-8'
+
+    return html.fromstring(response.content, parser=get_html_parser(encoding))
+
+
+@lru_cache(maxsize=None)
+def get_html_parser(encoding):
+
+    # pages are parsed one at a time on the main thread, so a parser per encoding can be reused
+    return html.HTMLParser(encoding=encoding)
+
+
 def process_webhooks(webhook_rows):
 
     # A webhook description has three parts: tags, activity type, and channel
@@ -143,14 +220,19 @@ def process_webhooks(webhook_rows):
         # Any questions, answers to #help-desk
         # Any machine-learning posts to #mits-demo
 
-    activity_types = ['edited questions', 'updated answers', 'accepted answers', 'questions', 
-                      'answers', 'comments']
+    # bind the lookups used for every row to locals once, outside the loop
+    match_description = DESCRIPTION_PATTERN.match
+    find_activities = ACTIVITY_TYPE_PATTERN.findall
+    remove_activities = ACTIVITY_TYPE_PATTERN.sub
+    all_activities = ACTIVITY_TYPES
     webhooks = []
+    add_webhook = webhooks.append
     for row in webhook_rows:
-        if row.find('th'): # skip header row
-            continue
-
-        columns = row.find_all('td')
+        columns = row.findall('td')
+        webhook_type = columns[0].text_content()
+        description = columns[2].text_content()
+        creator = columns[3].text_content()
+        creation_date = columns[4].text_content()
 
         # Description always starts with "Any" unless it's "All post activity to..."
             # Which means all tags and activity types
@@ -160,79 +242,60 @@ def process_webhooks(webhook_rows):
         # The word "posts" is used to denote all activity types
         # Activity types are comma-delimited; everything else is space-delimited
         # The words after "to" are the channel; also, surrounded by <b></b> tags
-        description = strip_html(columns[2].text).replace(
-            '(added via synonyms) ', '').replace(',', '')
-
-        if description.startswith('All post activity to'):
+        description = clean_text(description).replace('(added via synonyms) ', '')
+        match = match_description(description)
+        if not match:
+            # keep the webhook in the report with its raw description rather than dropping it
+            print(f'Unable to parse webhook description: {description}')
+            channel = description
+            tags = []
+            activities = []
+        elif match.group('body') is None: # "All post activity"
+            channel = match.group('channel')
             tags = ['all']
-            activities = activity_types
-            channel = description.split('All post activity to ')[1]
+            activities = list(all_activities)
         else:
-            description = description.split('Any ')[1] # strip "Any"
-            channel = description.split(' to ')[1]
-            if 'posts to' in description: # all activity types
-                activities = activity_types
-                tags = description.split(' posts to ')[0].split(' ')
+            channel = match.group('channel')
+            body = match.group('body').translate(COMMAS)
+            if body == 'posts' or body.endswith(' posts'): # all activity types
+                activities = list(all_activities)
+                tags = body[:-len('posts')].split() or ['all']
             else: # activity types are specified, but tags may or may not be
-                # of the remaining words, find which are tags and activity types
-                # activity types are comma-delimited
-                # tags are space-delimited
-                # tags are always first
-                # tags are always followed by activity types
-                description = description.split(' to ')[0] # strip off channel
-                activities = []
-                for activity_type in activity_types:
-                    if activity_type in description:
-                        activities.append(activity_type)
-                        description = description.replace(activity_type, '').strip()
-                if description:
-                    tags = description.split(' ')
-                else:
-                    tags = ['all']
-        
+                # tags are space-delimited and always come before the activity types
+                activities = find_activities(body)
+                tags = remove_activities('', body).split() or ['all']
+
         webhook = {
-            'type': strip_html(columns[0].text),
+            'type': clean_text(webhook_type),
             'channel': channel,
             'tags': tags,
             'activities': activities,
-            'creator': columns[3].text,
-            'creation_date': columns[4].text
+            'creator': creator,
+            'creation_date': creation_date
         }
-        webhooks.append(webhook)
+        add_webhook(webhook)
 
     return webhooks
 
 
-def strip_html(text):
+def clean_text(text):
 
-    return re.sub('<[^<]+?>', '', text).replace('\n', '').replace(
-        '\r', '').strip()
+    # text_content() is already tag-free; only line breaks and padding need removing
+    return text.translate(LINE_BREAKS).strip()
 
 
 def export_webhooks_to_csv(webhooks):
 
     file_name = 'webhooks.csv'
 
-    csv_header = list(webhooks[0].keys())
     with open(file_name, 'w', encoding='UTF8', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(csv_header)
+        writer = csv.DictWriter(f, fieldnames=list(webhooks[0].keys()))
+        writer.writeheader()
         for webhook in webhooks:
-            row_data = []
-            for name, attribute in webhook.items():
-                if name == 'tags':
-                    tag_row = ''
-                    for tag in attribute:
-                        tag_row += tag + ', '
-                    row_data.append(tag_row.strip(', '))
-                elif name == 'activities':
-                    activity_row = ''
-                    for activity in attribute:
-                        activity_row += activity + ', '
-                    row_data.append(activity_row.strip(', '))
-                else:
-                    row_data.append(attribute)
-            writer.writerow(row_data)
+            row = dict(webhook)
+            row['tags'] = ', '.join(webhook['tags'])
+            row['activities'] = ', '.join(webhook['activities'])
+            writer.writerow(row)
 
     print(f'CSV file created: {file_name}')
 